@@ -9,14 +9,33 @@
 #include <cerrno>
 #include <climits>
 #include <cstring>
+#include <mutex>
 #include <pybind11/pybind11.h>
 #include <pybind11/pytypes.h>
 #include <pybind11/stl.h>
+#include <vector>
 
 namespace py = pybind11;
 
 using namespace std::string_literals;
 
+// Note: the GIL is released during the calls to the shard_* functions doing
+// I/O or heavy computations, so each of the classes below uses a mutex to
+// serialize the accesses to its shard_t structure (and file). The mutex is
+// always acquired while the GIL is released, never the other way around.
+
+// Return a view on the given key content, without copying it, after having
+// checked its size
+static std::string_view key_view(const py::bytes &key) {
+    std::string_view kbuf = key;
+    if (kbuf.size() != SHARD_KEY_LEN) {
+        throw std::length_error(
+            "Invalid key size: "s + std::to_string(kbuf.size()) +
+            " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
+    }
+    return kbuf;
+}
+
 class ShardCreator {
   public:
     ShardCreator(const std::string &path, uint64_t n)
@@ -24,29 +43,47 @@ class ShardCreator {
         this->shard = shard_init(path.c_str());
     }
     ~ShardCreator() { shard_destroy(this->shard); }
-    void write(const py::bytes key, const py::bytes object) {
-        if (n_registered >= n_entries) {
+    void write(const py::bytes key, const py::buffer object) {
+        std::string_view kbuf = key_view(key);
+        // any object exposing a contiguous buffer (bytes, bytearray, mmap,
+        // memoryview...) is accepted, and written without being copied first
+        Py_buffer view;
+        if (PyObject_GetBuffer(object.ptr(), &view, PyBUF_SIMPLE) != 0)
+            throw py::error_already_set();
+        bool full = false;
+        int ret = 0;
+        {
+            py::gil_scoped_release release;
+            std::lock_guard<std::mutex> lock(mutex);
+            if (n_registered >= n_entries)
+                full = true;
+            else {
+                errno = 0;
+                ret = shard_object_write(this->shard, kbuf.data(),
+                                         (const char *)view.buf, view.len);
+                if (ret == 0)
+                    n_registered++;
+            }
+        }
+        PyBuffer_Release(&view);
+        if (full) {
             throw py::value_error(
                 "The declared number of objects has already been written");
         }
-        std::string_view kbuf = key;
-        if (kbuf.size() != SHARD_KEY_LEN) {
-            throw std::length_error(
-                "Invalid key size: "s + std::to_string(kbuf.size()) +
-                " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
-        }
-        std::string_view sv = object;
-        errno = 0;
-        if (shard_object_write(this->shard, kbuf.data(), sv.data(),
-                               sv.size()) != 0) {
+        if (ret != 0) {
             PyErr_SetFromErrno(PyExc_OSError);
             throw py::error_already_set();
         }
-        n_registered++;
     }
     ShardCreator &enter() {
-        errno = 0;
-        if (shard_prepare(this->shard, n_entries) != 0) {
+        int ret;
+        {
+            py::gil_scoped_release release;
+            std::lock_guard<std::mutex> lock(mutex);
+            errno = 0;
+            ret = shard_prepare(this->shard, n_entries);
+        }
+        if (ret != 0) {
             if (errno != 0) {
                 PyErr_SetFromErrno(PyExc_OSError);
                 throw py::error_already_set();
@@ -56,7 +93,11 @@ class ShardCreator {
         return *this;
     }
     void exit() {
-        errno = 0;
+        std::unique_lock<std::mutex> lock(mutex, std::defer_lock);
+        {
+            py::gil_scoped_release release;
+            lock.lock();
+        }
         if (n_registered < n_entries) {
             PyErr_SetString(
                 PyExc_RuntimeError,
@@ -64,7 +105,14 @@ class ShardCreator {
                 "number of entries; this is not allowed.");
             throw py::error_already_set();
         }
-        if (shard_finalize(this->shard) < 0) {
+        int ret;
+        {
+            // building the perfect hash function may take a while
+            py::gil_scoped_release release;
+            errno = 0;
+            ret = shard_finalize(this->shard);
+        }
+        if (ret < 0) {
             if (errno == 0) {
                 PyErr_SetString(PyExc_RuntimeError,
                                 "shard_finalize failed. Was there a duplicate "
@@ -83,11 +131,12 @@ class ShardCreator {
     shard_t *shard;
     uint64_t n_entries;
     uint64_t n_registered;
+    std::mutex mutex;
 };
 
 class ShardReader {
   public:
-    ShardReader(const std::string &path) {
+    ShardReader(const std::string &path, bool load_fingerprints = false) {
         this->shard = shard_init(path.c_str());
         errno = 0;
         if (shard_load(this->shard) != 0) {
@@ -95,6 +144,29 @@ class ShardReader {
             throw py::error_already_set();
         }
         this->endpos = shard_tell(this->shard) - 1;
+        if (load_fingerprints) {
+            int ret;
+            {
+                // this reads the whole Index section
+                py::gil_scoped_release release;
+                errno = 0;
+                ret = shard_fingerprints_load(this->shard);
+            }
+            if (ret < 0) {
+                // the destructor is not called when the constructor throws
+                int err = errno;
+                shard_destroy(this->shard);
+                this->shard = NULL;
+                if (err != 0) {
+                    errno = err;
+                    PyErr_SetFromErrno(PyExc_OSError);
+                    throw py::error_already_set();
+                } else
+                    throw std::runtime_error(
+                        "Keys fingerprints loading failed. Shard file might "
+                        "be corrupted.");
+            }
+        }
     }
     ~ShardReader() {
         // beware the close method (shard_close actually) may fail (not sure
@@ -105,13 +177,27 @@ class ShardReader {
         this->shard = NULL;
     }
     int close() {
+        py::gil_scoped_release release;
+        std::lock_guard<std::mutex> lock(mutex);
         errno = 0;
         int ret = shard_close(this->shard);
         return ret;
     }
     py::bytes getitem(const py::bytes key) {
-        // get size and position file descriptor at the beginning of the object
-        uint64_t size = getsize(key);
+        std::string_view kbuf = key_view(key);
+        // the lock must be held from the lookup of the object to the end of
+        // its reading, since the former positions the file at the beginning
+        // of the object
+        std::unique_lock<std::mutex> lock(mutex, std::defer_lock);
+        uint64_t size;
+        int ret;
+        {
+            py::gil_scoped_release release;
+            lock.lock();
+            ret = shard_find_object(this->shard, kbuf.data(), &size);
+        }
+        if (ret != 0)
+            throw py::key_error("key not found");
         if (size > (uint64_t)SSIZE_MAX) {
             PyErr_SetString(PyExc_ValueError,
                             "Object size overflows python bytes max size "
@@ -124,24 +210,87 @@ class ShardReader {
         // string_view.data() returns a const pointer, so enforce the cast to a
         // char* (yep, that's not nice...)
         char *buf = (char *)std::string_view(b).data();
-        if (shard_read_object(this->shard, buf, size) != 0)
+        {
+            py::gil_scoped_release release;
+            ret = shard_read_object(this->shard, buf, size);
+        }
+        if (ret != 0)
             throw std::runtime_error(
                 "Content read failed. Shard file might be corrupted.");
         return b;
     }
+    py::list getitems(const py::iterable keys) {
+        // keep a reference on the keys, so their views remain valid while the
+        // GIL is released
+        std::vector<py::bytes> bkeys;
+        std::vector<std::string_view> kbufs;
+        for (auto key : keys) {
+            bkeys.push_back(py::reinterpret_borrow<py::object>(key));
+            kbufs.push_back(key_view(bkeys.back()));
+        }
+        std::vector<uint64_t> sizes(kbufs.size());
+        std::vector<uint64_t> positions(kbufs.size());
+        bool found = true;
+        int ret = 0;
+        // the lock is held for the whole batch, and the GIL is released
+        // twice: to look up all the objects, and to read them once the bytes
+        // objects they are read into have been allocated
+        std::unique_lock<std::mutex> lock(mutex, std::defer_lock);
+        {
+            py::gil_scoped_release release;
+            lock.lock();
+            for (size_t i = 0; i < kbufs.size(); i++) {
+                if (shard_find_object(this->shard, kbufs[i].data(),
+                                      &sizes[i]) != 0) {
+                    found = false;
+                    break;
+                }
+                positions[i] = shard_tell(this->shard);
+            }
+        }
+        if (!found)
+            throw py::key_error("key not found");
+        py::list objects(kbufs.size());
+        std::vector<char *> bufs(kbufs.size());
+        for (size_t i = 0; i < kbufs.size(); i++) {
+            if (sizes[i] > (uint64_t)SSIZE_MAX) {
+                PyErr_SetString(PyExc_ValueError,
+                                "Object size overflows python bytes max size "
+                                "(are you still using a 32bits system?)");
+                throw py::error_already_set();
+            }
+            py::bytes b = py::bytes(NULL, (ssize_t)sizes[i]);
+            bufs[i] = (char *)std::string_view(b).data();
+            objects[i] = b;
+        }
+        {
+            py::gil_scoped_release release;
+            for (size_t i = 0; i < kbufs.size() && ret == 0; i++) {
+                ret = shard_seek(this->shard, positions[i], SEEK_SET);
+                if (ret == 0)
+                    ret = shard_read_object(this->shard, bufs[i], sizes[i]);
+            }
+        }
+        if (ret != 0)
+            throw std::runtime_error(
+                "Content read failed. Shard file might be corrupted.");
+        return objects;
+    }
     uint64_t getpos(const py::bytes key) {
         uint64_t pos;
-        std::string kbuf = std::string(key);
-        if (kbuf.size() != SHARD_KEY_LEN) {
-            throw std::length_error(
-                "Invalid key size: "s + std::to_string(kbuf.size()) +
-                " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
-        }
+        std::string_view kbuf = key_view(key);
         shard_cmph_search(this->shard, kbuf.data(), &pos);
         return pos;
     }
     void getindex(uint64_t pos, shard_index_t &idx) {
-        if (shard_index_get(this->shard, pos, &idx) < 0) {
+        int ret;
+        {
+            py::gil_scoped_release release;
+            std::lock_guard<std::mutex> lock(mutex);
+            errno = 0;
+            ret = shard_index_get(this->shard, pos, &idx);
+        }
+        if (ret < 0) {
             if (errno != 0)
                 PyErr_SetFromErrno(PyExc_OSError);
             else
@@ -154,22 +303,43 @@ class ShardReader {
         }
     }
     uint64_t getsize(const py::bytes key) {
-        std::string kbuf = std::string(key);
-        if (kbuf.size() != SHARD_KEY_LEN) {
-            throw std::length_error(
-                "Invalid key size: "s + std::to_string(kbuf.size()) +
-                " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
-        }
+        std::string_view kbuf = key_view(key);
         uint64_t size;
-        if (shard_find_object(this->shard, kbuf.data(), &size) != 0)
+        int ret;
+        {
+            py::gil_scoped_release release;
+            std::lock_guard<std::mutex> lock(mutex);
+            ret = shard_find_object(this->shard, kbuf.data(), &size);
+        }
+        if (ret != 0)
             throw py::key_error("key not found");
         return size;
     }
+    std::pair<uint64_t, uint64_t> locate(const py::bytes key) {
+        std::string_view kbuf = key_view(key);
+        uint64_t size, position;
+        int ret;
+        {
+            py::gil_scoped_release release;
+            std::lock_guard<std::mutex> lock(mutex);
+            ret = shard_find_object(this->shard, kbuf.data(), &size);
+            // shard_find_object() leaves the file at the beginning of the
+            // object content
+            if (ret == 0)
+                position = shard_tell(this->shard);
+        }
+        if (ret != 0)
+            throw py::key_error("key not found");
+        return std::make_pair(position, size);
+    }
     shard_t *shard;
     uint64_t endpos;
+    std::mutex mutex;
 };
 
 PYBIND11_MODULE(_shard, m) {
+    m.attr("KEY_LEN") = SHARD_KEY_LEN;
+
     py::class_<ShardCreator>(m, "ShardCreator")
         .def(py::init<const std::string &, uint64_t>(),
              "Instantiate a ShardCreator object\n\n"
@@ -196,7 +366,11 @@ PYBIND11_MODULE(_shard, m) {
                      s.exit();
              })
         .def("write", &ShardCreator::write,
-             "Write a new object in the shard file identified by given key",
+             "Write a new object in the shard file identified by given key\n\n"
+             "Arguments:\n"
+             "  key: the key of the object\n"
+             "  object: the object content, as a bytes or any other object "
+             "supporting the (contiguous) buffer protocol\n",
              py::arg("key"), py::arg("object"))
         .def_property_readonly_static(
             "key_len", [](py::object) { return SHARD_KEY_LEN; },
@@ -207,12 +381,18 @@ PYBIND11_MODULE(_shard, m) {
         .def_property_readonly_static(
             "key_len", [](py::object /* self */) { return SHARD_KEY_LEN; },
             "Size of the key (in bytes)")
-        .def(py::init<const std::string &>(),
+        .def(py::init<const std::string &, bool>(),
              "Instantiate a ShardReader object\n\n"
              "Arguments:\n"
              "  path: the filename of the shard to read\n"
+             "  load_fingerprints: if true, load in memory a small "
+             "fingerprint of each key of the index (reading the whole Index "
+             "section), so looking up a key that is not in the shard file "
+             "does not require any disk access most of the time; this is "
+             "skipped if the fingerprints would use more than 128MiB of "
+             "memory\n"
              "\n",
-             py::arg("path"))
+             py::arg("path"), py::arg("load_fingerprints") = false)
         .def("close", &ShardReader::close,
              "Close the shard\n\n"
              "Unload the shard index and CMPH data structure and close the "
@@ -224,6 +404,12 @@ PYBIND11_MODULE(_shard, m) {
                                })
         .def_property_readonly(
             "endpos", [](ShardReader &s) -> const uint64_t { return s.endpos; })
+        .def_property_readonly(
+            "fingerprints_loaded",
+            [](ShardReader &s) -> bool {
+                return s.shard->fingerprints != NULL;
+            },
+            "Whether the keys fingerprints are loaded in memory")
         .def(
             "getindex",
             [](ShardReader &s, uint64_t pos) -> shard_index_t {
@@ -247,6 +433,17 @@ PYBIND11_MODULE(_shard, m) {
              "If the key is not found in the shard file, throw a KeyError "
              "exception.\n",
              py::arg("key"))
+        .def("locate", &ShardReader::locate,
+             "Get the position and size of the object from the given key\n\n"
+             "Arguments:\n"
+             "  key: the key of the object to look for\n"
+             "Returns:\n"
+             "  a (position, size) tuple, position being the offset of the "
+             "object content in the shard file\n"
+             "\n"
+             "If the key is not found in the shard file, throw a KeyError "
+             "exception.\n",
+             py::arg("key"))
         .def("getpos", &ShardReader::getpos,
              "Get the index position for the given key\n\n"
              "Arguments:\n"
@@ -258,13 +455,9 @@ PYBIND11_MODULE(_shard, m) {
         .def_static(
             "delete",
             [](const std::string &path, const py::bytes key) {
-                std::string_view kbuf = key;
-                if (kbuf.size() != SHARD_KEY_LEN) {
-                    throw std::length_error(
-                        "Invalid key size: "s + std::to_string(kbuf.size()) +
-                        " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
-                }
+                std::string_view kbuf = key_view(key);
                 ShardReader reader(path);
+                py::gil_scoped_release release;
                 shard_delete(reader.shard, kbuf.data());
             },
             "Remove an entry from the given shard file\n\n"
@@ -280,18 +473,7 @@ PYBIND11_MODULE(_shard, m) {
             py::arg("path"), py::arg("key"))
         .def(
             "find",
-            [](ShardReader &s, const py::bytes key) {
-                std::string_view kbuf = key;
-                if (kbuf.size() != SHARD_KEY_LEN) {
-                    throw std::length_error(
-                        "Invalid key size: "s + std::to_string(kbuf.size()) +
-                        " (expected: " + std::to_string(SHARD_KEY_LEN) + ")");
-                }
-                uint64_t size;
-                if (shard_find_object(s.shard, kbuf.data(), &size) != 0)
-                    throw py::key_error("key not found");
-                return size;
-            },
+            [](ShardReader &s, const py::bytes key) { return s.getsize(key); },
             "Look for an object in the shard file from its key\n\n"
             "Arguments:\n"
             "  key: the key to look for\n"
@@ -312,6 +494,22 @@ PYBIND11_MODULE(_shard, m) {
              "  RuntimeError: if the content could not be read (IO error)\n"
              "\n",
              py::arg("key"))
+        .def("lookup_many", &ShardReader::getitems,
+             "Return the objects from the shard file at given keys\n\n"
+             "This is the same as calling .lookup() for each key, but the "
+             "iteration is done by the C extension, thus saving the python "
+             "overhead of one method call per key, and all the objects are "
+             "looked up and read without the GIL.\n\n"
+             "Arguments:\n"
+             "  keys: an iterable of keys of the objects to look for\n"
+             "Returns:\n"
+             "  the list of objects contents as bytes, in the same order\n"
+             "Raises:\n"
+             "  KeyError: if one of the keys is not found in the shard file\n"
+             "  ValueError: if an object size is too big\n"
+             "  RuntimeError: if a content could not be read (IO error)\n"
+             "\n",
+             py::arg("keys"))
         .doc() =
         ("A shard file reader helper class\n\n"
          "This allows to easily read a shord file, get information (header) "
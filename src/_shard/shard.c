@@ -23,8 +23,6 @@ extern "C" {
 
 #include "shard.h"
 
-const int shard_key_len = SHARD_KEY_LEN;
-
 #ifdef HASH_DEBUG
 #define debug(...) printf(__VA_ARGS__)
 #else
@@ -481,10 +479,23 @@ int shard_prepare(shard_t *shard, uint64_t objects_count) {
  * Lookup objects from a Read Shard
  */
 
+static shard_fingerprint_t shard_key_fingerprint(const char *key) {
+    shard_fingerprint_t fingerprint;
+    memcpy(&fingerprint, key, sizeof(shard_fingerprint_t));
+    return fingerprint;
+}
+
 int shard_find_object(shard_t *shard, const char *key, uint64_t *object_size) {
     debug("shard_find_object\n");
     cmph_uint32 h = cmph_search(shard->hash, key, SHARD_KEY_LEN);
     debug("shard_find_object: h = %d\n", h);
+    /* If the fingerprints are loaded, most of the keys that are not in the
+     * shard can be rejected without reading the index. */
+    if (shard->fingerprints != NULL && h < shard->fingerprints_count &&
+        shard->fingerprints[h] != shard_key_fingerprint(key)) {
+        debug("shard_find_object: fingerprint mismatch\n");
+        return 1;
+    }
     uint64_t index_offset =
         shard->header.index_position + h * sizeof(shard_index_t);
     debug("shard_find_object: index_offset = %" PRIu64 "\n", index_offset);
@@ -548,6 +559,51 @@ int shard_hash_load(shard_t *shard) {
     return 0;
 }
 
+/**********************************************************
+ * Load the fingerprints of all the keys of the index in memory.
+ *
+ * Returns:
+ *  0 if the fingerprints have been loaded,
+ *  1 if they would use more than SHARD_MAX_FINGERPRINTS_SIZE bytes of memory,
+ *    in which case they are not loaded,
+ * -1 in case of error.
+ */
+int shard_fingerprints_load(shard_t *shard) {
+#define BATCH_SIZE 1024
+    uint64_t count = shard->header.index_size / sizeof(shard_index_t);
+    if (count > SHARD_MAX_FINGERPRINTS_SIZE / sizeof(shard_fingerprint_t)) {
+        debug("shard_fingerprints_load: too many index entries (%" PRIu64 ")\n",
+              count);
+        return 1;
+    }
+    if (shard_seek(shard, shard->header.index_position, SEEK_SET) < 0) {
+        printf("shard_fingerprints_load: index_position\n");
+        return -1;
+    }
+    shard_fingerprint_t *fingerprints = (shard_fingerprint_t *)malloc(
+        MAX(count, 1) * sizeof(shard_fingerprint_t));
+    if (fingerprints == NULL) {
+        printf("shard_fingerprints_load: cannot allocate memory\n");
+        return -1;
+    }
+    shard_index_t index[BATCH_SIZE];
+    for (uint64_t i = 0; i < count; i += BATCH_SIZE) {
+        uint64_t n = MIN(count - i, BATCH_SIZE);
+        if (shard_read(shard, (void *)index, n * sizeof(shard_index_t)) < 0) {
+            printf("shard_fingerprints_load: index\n");
+            free(fingerprints);
+            return -1;
+        }
+        for (uint64_t j = 0; j < n; j++)
+            fingerprints[i + j] = shard_key_fingerprint(index[j].key);
+    }
+    free(shard->fingerprints);
+    shard->fingerprints = fingerprints;
+    shard->fingerprints_count = count;
+    return 0;
+#undef BATCH_SIZE
+}
+
 int shard_load(shard_t *shard) {
     debug("shard_load\n");
     if (shard_open(shard, "r") < 0) {
@@ -684,6 +740,8 @@ int shard_destroy(shard_t *shard) {
         cmph_destroy(shard->hash);
     if (shard->index)
         free(shard->index);
+    if (shard->fingerprints)
+        free(shard->fingerprints);
     free(shard->path);
     int r = shard_close(shard);
     free(shard);
@@ -17,7 +17,10 @@ extern "C" {
 #define SHARD_OFFSET_HEADER 512
 #define SHARD_KEY_LEN 32
 #define SHARD_MAX_OBJECTS (SIZE_MAX / (SHARD_KEY_LEN + sizeof(shard_index_t)))
-extern const int shard_key_len;
+
+/* Maximum amount of memory used by the keys fingerprints loaded by
+ * shard_fingerprints_load() */
+#define SHARD_MAX_FINGERPRINTS_SIZE (128 * 1024 * 1024)
 
 #define SHARD_MAGIC "SWHShard"
 #define SHARD_VERSION 1
@@ -72,12 +75,22 @@ typedef struct {
     uint64_t object_offset;
 } shard_index_t;
 
+/* Fingerprint of a key (its first bytes), used to reject most unknown keys
+ * without reading the index (see shard_fingerprints_load()) */
+typedef uint16_t shard_fingerprint_t;
+
 typedef struct {
     char *path;
     FILE *f;
     shard_header_t header;
     cmph_t *hash;
 
+    // The following fields are only used when reading the Read Shard, if
+    // shard_fingerprints_load() has been called: the fingerprint of the key
+    // of each entry of the index, in the same order
+    shard_fingerprint_t *fingerprints;
+    uint64_t fingerprints_count;
+
     // The following fields are only used when creating the Read Shard
     cmph_io_adapter_t *source;
     cmph_config_t *config;
@@ -95,6 +108,7 @@ int shard_object_write(shard_t *shard, const char *key, const char *object,
 int shard_finalize(shard_t *shard);
 
 int shard_load(shard_t *shard);
+int shard_fingerprints_load(shard_t *shard);
 int shard_find_object(shard_t *shard, const char *key, uint64_t *object_size);
 int shard_read_object(shard_t *shard, char *object, uint64_t object_size);
 
@@ -163,6 +163,60 @@ TEST(ShardTest, Many) {
     filesystem::remove_all(tmpdir);
 }
 
+TEST(ShardTest, Fingerprints) {
+    auto tmpdir = create_temporary_directory();
+    filesystem::path tmpfile = tmpdir / std::string("shard");
+
+    std::map<std::string, std::string> key2object;
+
+    shard_t *shard = shard_init(tmpfile.c_str());
+    ASSERT_NE(shard, nullptr);
+    int objects_count = 100;
+    ASSERT_GE(shard_prepare(shard, objects_count), 0);
+    for (int i = 0; i < objects_count; i++) {
+        std::string key = gen_random(SHARD_KEY_LEN);
+        std::string object = gen_random(i + 1);
+        key2object[key] = object;
+        ASSERT_GE(shard_object_write(shard, key.c_str(), object.c_str(),
+                                     object.length()),
+                  0);
+    }
+    ASSERT_GE(shard_finalize(shard), 0);
+    ASSERT_GE(shard_destroy(shard), 0);
+
+    //
+    // Open the Read Shard with the keys fingerprints loaded, and verify
+    // every key is still found while unknown keys are not.
+    //
+    shard = shard_init(tmpfile.c_str());
+    ASSERT_NE(shard, nullptr);
+    ASSERT_GE(shard_load(shard), 0);
+    ASSERT_EQ(shard_fingerprints_load(shard), 0);
+    ASSERT_EQ(shard->fingerprints_count,
+              shard->header.index_size / sizeof(shard_index_t));
+    for (std::pair<std::string, std::string> p : key2object) {
+        uint64_t found_size = 0;
+        ASSERT_EQ(shard_find_object(shard, p.first.c_str(), &found_size), 0);
+        ASSERT_EQ(p.second.length(), found_size);
+        char *found = (char *)malloc(found_size);
+        ASSERT_GE(shard_read_object(shard, found, found_size), 0);
+        ASSERT_EQ(memcmp((const void *)p.second.c_str(), (const void *)found,
+                         found_size),
+                  0);
+        free(found);
+    }
+    for (int i = 0; i < objects_count; i++) {
+        std::string key = gen_random(SHARD_KEY_LEN);
+        if (key2object.count(key))
+            continue;
+        uint64_t found_size = 0;
+        ASSERT_NE(shard_find_object(shard, key.c_str(), &found_size), 0);
+    }
+    ASSERT_GE(shard_destroy(shard), 0);
+
+    filesystem::remove_all(tmpdir);
+}
+
 int main(int argc, char **argv) {
     testing::InitGoogleTest(&argc, argv);
     return RUN_ALL_TESTS();
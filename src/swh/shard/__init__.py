@@ -3,22 +3,29 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
-from ._shard import ShardCreator, ShardReader
+import importlib
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["Shard", "ShardCreator"]
+if TYPE_CHECKING:
+    from ._reader import Shard
+    from ._shard import KEY_LEN, ShardCreator
 
+__all__ = ["KEY_LEN", "Shard", "ShardCreator"]
 
-class Shard(ShardReader):
-    # for BW compat reason, implement the context manager protocol
-    def __enter__(self):
-        return self
+# public names and the (relative) module they are actually defined in
+_LAZY_ATTRS = {
+    "KEY_LEN": "._shard",
+    "Shard": "._reader",
+    "ShardCreator": "._shard",
+}
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
 
-    def __iter__(self):
-        # iterate of the keys
-        for i in range(self.header.index_size // (32 + 8)):  # KEY_LEN + uint64
-            idx = self.getindex(i)
-            if idx.object_offset < (2**64 - 1):
-                yield idx.key
+def __getattr__(name: str) -> Any:
+    # the C extension is only loaded on first access to one of its classes, so
+    # that importing swh.shard.cli (e.g. for 'swh shard --help' or shell
+    # completion) does not pay for it
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,59 @@
+# Copyright (C) 2021-2025  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import mmap
+from typing import Optional
+
+from ._shard import KEY_LEN, ShardReader
+
+# size of an entry of the Index section: key + object offset (uint64)
+INDEX_ENTRY_SIZE = KEY_LEN + 8
+# object offset of a deleted/non-populated index entry
+NULL_OFFSET = 2**64 - 1
+
+
+class Shard(ShardReader):
+    def __init__(self, path: str, *args, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.path = path
+        self._view: Optional[memoryview] = None
+
+    def close(self):
+        # the mapping itself is released once the buffers returned by
+        # lookup_buffer() are not used anymore
+        self._view = None
+        return super().close()
+
+    def lookup_buffer(self, key: bytes) -> memoryview:
+        """Return the object from the shard file at given key, as a read-only
+        memoryview on the (mmap-ed) shard file, i.e. without copying it.
+
+        Raises:
+          KeyError: if the key is not found in the shard file
+          RuntimeError: if the object is not entirely in the shard file
+        """
+        start, size = self.locate(key)
+        view = self._view
+        if view is None:
+            with open(self.path, "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._view = view
+        if start + size > len(view):
+            raise RuntimeError("Content read failed. Shard file might be corrupted.")
+        return view[start : start + size]
+
+    # for BW compat reason, implement the context manager protocol
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        # iterate of the keys
+        for i in range(self.header.index_size // INDEX_ENTRY_SIZE):
+            idx = self.getindex(i)
+            if idx.object_offset < NULL_OFFSET:
+                yield idx.key
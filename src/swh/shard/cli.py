@@ -4,6 +4,7 @@
 # See top-level LICENSE file for more information
 
 import logging
+import sys
 
 import click
 
@@ -18,14 +19,53 @@ NULLKEY = b"\x00" * 32
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
-try:
-    # make this cli usable both from the swh.core's 'swh' cli group and from
-    # direct swh-shard command (since swh-shard does not depend on swh.core)
-    from swh.core.cli import swh
+# 'shard create' keeps the content of files up to this size in memory between
+# the deduplication step and the actual write in the shard file, so they are
+# read only once, as long as the total cached size stays below the second limit;
+# other files are mmap-ed instead of being loaded in memory
+CREATE_CACHE_MAX_FILE_SIZE = 4 * 1024 * 1024
+CREATE_CACHE_MAX_SIZE = 256 * 1024 * 1024
+# maximum number of files being read and hashed concurrently by 'shard create'
+CREATE_MAX_PENDING_FILES = 32
+# number of lines written at once by 'shard ls'
+LIST_CHUNK_LINES = 1024
+
+
+def _get_cli_group():
+    """Return the decorator used to declare the main shard cli group
+
+    This cli is usable both from the swh.core's 'swh' cli group and from the
+    direct swh-shard command (since swh-shard does not depend on swh.core).
+    In the former case, swh.core.cli imports this module via the
+    'swh.cli.subcommands' entry point, so it has already been loaded; in the
+    latter case, there is no need to pay for importing swh.core at all.
+    """
+    swh_core_cli = sys.modules.get("swh.core.cli")
+    if swh_core_cli is not None:
+        return swh_core_cli.swh.group
+    return click.group
+
+
+cli_group = _get_cli_group()
+
 
-    cli_group = swh.group
-except (ImportError, ModuleNotFoundError):
-    cli_group = click.group
+def _imap_bounded(executor, fn, iterable, max_pending):
+    """Like executor.map(fn, iterable), but with at most max_pending calls
+    submitted ahead of the consumer, to keep the memory usage under control
+
+    Results are yielded in order, as (item, fn(item)) tuples.
+    """
+    import collections
+
+    pending = collections.deque()
+    for item in iterable:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= max_pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
 
 
 @cli_group(name="shard", context_settings=CONTEXT_SETTINGS)
@@ -128,9 +168,10 @@ def shard_truncate(ctx, shard, assume_yes):
 def shard_create(ctx, shard, files, sort_files):
     "Create a shard file from given files"
 
+    from concurrent.futures import ThreadPoolExecutor
     import hashlib
+    import mmap
     import os
-    import sys
 
     from swh.shard import ShardCreator
 
@@ -142,28 +183,91 @@ def shard_create(ctx, shard, files, sort_files):
         # read file names from stdin
         files = [fname.strip() for fname in sys.stdin.read().splitlines()]
     click.echo(f"There are {len(files)} entries")
-    hashes = set()
+    sha256 = hashlib.sha256
+
+    def file_identity(fname):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            # let check_file() deal with it
+            return fname
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    # the same file given several times (or via hard links) is read only once
+    seen = set()
+    to_check = []
+    for fname in files:
+        identity = file_identity(fname)
+        if identity not in seen:
+            seen.add(identity)
+            to_check.append(fname)
+
+    def check_file(fname):
+        # run in worker threads: hashlib releases the GIL while hashing the
+        # whole content in one call, so files are hashed in parallel
+        try:
+            with open(fname, "rb") as f:
+                if os.fstat(f.fileno()).st_size <= CREATE_CACHE_MAX_FILE_SIZE:
+                    data = f.read()
+                    return sha256(data, usedforsecurity=False).digest(), data
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return sha256(mm, usedforsecurity=False).digest(), None
+        except OSError:
+            return None, None
+
+    def open_file(item):
+        # run in a worker thread, ahead of the writer: map the content of
+        # files that have not been kept in memory, and ask the kernel to start
+        # reading it, so the disk reads overlap with the writes of the
+        # previous files in the shard
+        digest, (fname, data) = item
+        if data is not None:
+            return data
+        with open(fname, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mm.madvise(mmap.MADV_WILLNEED)
+        return mm
+
+    # sha256 -> (fname, content or None if it must be read again); the first
+    # file found for a given sha256 is the one added to the shard
     files_to_add = {}
-    with click.progressbar(files, label="Checking files to add") as bfiles:
-        for fname in bfiles:
-            try:
-                with open(fname, "rb") as f:
-                    sha256 = hashlib.sha256(f.read()).digest()
-                    if sha256 not in hashes:
-                        files_to_add[fname] = sha256
-                        hashes.add(sha256)
-            except OSError:
-                continue
+    cached_size = 0
+    with ThreadPoolExecutor() as executor:
+        results = _imap_bounded(
+            executor, check_file, to_check, CREATE_MAX_PENDING_FILES
+        )
+        with click.progressbar(
+            results, length=len(to_check), label="Checking files to add"
+        ) as bresults:
+            for fname, (digest, data) in bresults:
+                if digest is None or digest in files_to_add:
+                    continue
+                if data is not None:
+                    if cached_size + len(data) <= CREATE_CACHE_MAX_SIZE:
+                        cached_size += len(data)
+                    else:
+                        data = None
+                files_to_add[digest] = (fname, data)
     click.echo(f"after deduplication: {len(files_to_add)} entries")
 
     with ShardCreator(shard, len(files_to_add)) as shard:
         it = files_to_add.items()
         if sort_files:
-            it = sorted(it, key=lambda x: x[0][-1::-1])
-        with click.progressbar(it, label="Adding files to the shard") as items:
-            for fname, sha256 in items:
-                with open(fname, "rb") as f:
-                    shard.write(sha256, f.read())
+            # sort on the inversed file names; note that sorted() computes the
+            # key only once per item, not for each comparison
+            it = sorted(it, key=lambda item: item[1][0][::-1])
+        # a single worker is enough to keep the writer (the main thread, the
+        # ShardCreator must not be used concurrently) busy
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            contents = _imap_bounded(executor, open_file, it, CREATE_MAX_PENDING_FILES)
+            with click.progressbar(
+                contents, length=len(files_to_add), label="Adding files to the shard"
+            ) as bcontents:
+                for (digest, _), content in bcontents:
+                    shard.write(digest, content)
+                    if isinstance(content, mmap.mmap):
+                        content.close()
     click.echo("Done")
 
 
@@ -176,6 +280,9 @@ def shard_list(ctx, skip_removed, shard):
 
     from swh.shard import Shard
 
+    # output lines are written by chunks rather than one by one, which is
+    # much faster for shards with millions of objects
+    lines = []
     with Shard(shard) as s:
         for key in s:
             if skip_removed and key == NULLKEY:
@@ -184,7 +291,12 @@ def shard_list(ctx, skip_removed, shard):
                 size = s.getsize(key)
             except KeyError:
                 size = "N/A"
-            click.echo(f"{key.hex()}: {size} bytes")
+            lines.append(f"{key.hex()}: {size} bytes\n")
+            if len(lines) >= LIST_CHUNK_LINES:
+                click.echo("".join(lines), nl=False)
+                lines.clear()
+    if lines:
+        click.echo("".join(lines), nl=False)
 
 
 @shard_cli_group.command("get")
@@ -194,11 +306,26 @@ def shard_list(ctx, skip_removed, shard):
 def shard_get(ctx, shard, keys):
     "List objects in a shard file"
 
-    from swh.shard import Shard
+    from swh.shard import KEY_LEN, Shard
 
+    bkeys = []
+    for key in keys:
+        try:
+            bkey = bytes.fromhex(key)
+        except ValueError:
+            bkey = b""
+        if len(bkey) != KEY_LEN:
+            ctx.fail(f"{key}: key is invalid")
+        bkeys.append(bkey)
+
+    # objects are written as is to the binary stdout, straight from the shard
+    # file (see Shard.lookup_buffer()), and flushed once at the end
+    stdout = sys.stdout.buffer
     with Shard(shard) as s:
-        for key in keys:
-            click.echo(s[bytes.fromhex(key)], nl=False)
+        for key in bkeys:
+            with s.lookup_buffer(key) as obj:
+                stdout.write(obj)
+    stdout.flush()
 
 
 @shard_cli_group.command("delete")
@@ -222,8 +349,6 @@ def shard_delete(ctx, shard, keys, confirm):
     If at least one key is missing or invalid, the whole process is aborted.
 
     """
-    import sys
-
     if keys == ("-",):
         keys = sys.stdin.read().split()
         confirm = False
@@ -370,6 +495,11 @@ def shard_check(ctx, shard, with_hash):
 
 
 def main():
+    # Entry point of the standalone swh-shard command. When used as 'swh shard'
+    # instead, swh.core.cli is in charge: it imports this module (so
+    # shard_cli_group gets attached to its main 'swh' group, see
+    # _get_cli_group()) and this function is not called.
+
     # Even though swh() sets up logging, we need an earlier basic logging setup
     # for the next few logging statements
     logging.basicConfig()
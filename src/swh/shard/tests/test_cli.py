@@ -6,6 +6,8 @@
 from hashlib import sha256
 import re
 import struct
+import subprocess
+import sys
 
 from click.testing import CliRunner
 import pytest
@@ -137,6 +139,53 @@ def test_cli():
     assert "Software Heritage Shard tools" in result.output
 
 
+def test_cli_help_does_not_load_extension():
+    # run in a fresh interpreter since the test session already loaded it
+    code = (
+        "import sys\n"
+        "from swh.shard import cli\n"
+        "try:\n"
+        "    cli.shard_cli_group(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "assert 'swh.shard._shard' not in sys.modules\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert "Software Heritage Shard tools" in result.stdout
+
+
+def test_cli_standalone_does_not_import_swh_core():
+    code = (
+        "import sys\n"
+        "from swh.shard import cli\n"
+        "assert 'swh.core.cli' not in sys.modules\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_cli_attached_to_swh_core_group():
+    # mimic swh.core.cli loading this module from its entry point
+    code = (
+        "import sys, types\n"
+        "import click\n"
+        "swh_core_cli = types.ModuleType('swh.core.cli')\n"
+        "swh_core_cli.swh = click.Group('swh')\n"
+        "sys.modules['swh.core.cli'] = swh_core_cli\n"
+        "from swh.shard import cli\n"
+        "assert swh_core_cli.swh.commands['shard'] is cli.shard_cli_group\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+
+
 def test_cli_info(small_shard):
     runner = CliRunner()
     result = runner.invoke(cli.shard_info, [str(small_shard)])
@@ -237,6 +286,18 @@ def test_cli_ls(small_shard):
     }
 
 
+def test_cli_ls_chunked(small_shard, mocker):
+    # 16 entries written by chunks of 5 lines
+    mocker.patch.object(cli, "LIST_CHUNK_LINES", 5)
+    runner = CliRunner()
+    result = runner.invoke(cli.shard_list, [str(small_shard)])
+    assert result.exit_code == 0
+    assert result.output.endswith("\n")
+    assert sorted(result.output.splitlines()) == [
+        f"{i:064x}: 42 bytes" for i in range(16)
+    ]
+
+
 def test_cli_get(small_shard):
     runner = CliRunner()
     for i in range(16):
@@ -245,6 +306,24 @@ def test_cli_get(small_shard):
         assert result.output == chr(65 + i) * 42
 
 
+def test_cli_get_many(small_shard):
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.shard_get, [str(small_shard), *(f"{i:-064x}" for i in (3, 1, 3))]
+    )
+    assert result.exit_code == 0
+    assert result.stdout_bytes == b"D" * 42 + b"B" * 42 + b"D" * 42
+
+
+@pytest.mark.parametrize("key", ["zz", "ab", "00" * 33])
+def test_cli_get_invalid_key(small_shard, key):
+    runner = CliRunner()
+    result = runner.invoke(cli.shard_get, [str(small_shard), f"{1:-064x}", key])
+    assert result.exit_code == 2
+    assert f"{key}: key is invalid" in result.output
+    assert "B" * 42 not in result.output
+
+
 def test_cli_create(tmp_path):
     runner = CliRunner()
 
@@ -266,6 +345,82 @@ def test_cli_create(tmp_path):
         assert sorted(list(s)) == sorted(hashes)
 
 
+def test_cli_create_partially_cached(tmp_path, mocker):
+    # only cache files up to 8 bytes, and at most 32 bytes of them overall
+    mocker.patch.object(cli, "CREATE_CACHE_MAX_FILE_SIZE", 8)
+    mocker.patch.object(cli, "CREATE_CACHE_MAX_SIZE", 32)
+    runner = CliRunner()
+
+    files = []
+    contents = {}
+    for i in range(16):
+        f = tmp_path / f"file_{i}"
+        data = f"file {i}".encode() * (1 + i % 3)
+        f.write_bytes(data)
+        files.append(str(f))
+        contents[sha256(data).digest()] = data
+    # add a duplicated content
+    (tmp_path / "file_dup").write_bytes(b"file 1" * 2)
+    files.append(str(tmp_path / "file_dup"))
+    # and a file that cannot be read
+    files.append(str(tmp_path / "missing"))
+
+    shard = tmp_path / "shard"
+    result = runner.invoke(cli.shard_create, [str(shard), *files])
+    assert result.exit_code == 0, result.output
+    assert "There are 18 entries" in result.output
+    assert "after deduplication: 16 entries" in result.output
+    with Shard(str(shard)) as s:
+        assert s.header.objects_count == 16
+        assert sorted(s) == sorted(contents)
+        for key, data in contents.items():
+            assert s[key] == data
+
+
+def test_cli_create_same_file_hashed_once(tmp_path, mocker):
+    sha256_mock = mocker.patch("hashlib.sha256", wraps=sha256)
+    runner = CliRunner()
+
+    file_a = tmp_path / "file_a"
+    file_a.write_bytes(b"a")
+    file_b = tmp_path / "file_b"
+    file_b.write_bytes(b"b")
+    (tmp_path / "link_a").hardlink_to(file_a)
+    files = [str(file_a), str(file_b), str(file_a), str(tmp_path / "link_a")]
+
+    shard = tmp_path / "shard"
+    result = runner.invoke(cli.shard_create, [str(shard), *files])
+    assert result.exit_code == 0, result.output
+    assert "There are 4 entries" in result.output
+    assert "after deduplication: 2 entries" in result.output
+    assert sha256_mock.call_count == 2
+    with Shard(str(shard)) as s:
+        assert s[sha256(b"a").digest()] == b"a"
+        assert s[sha256(b"b").digest()] == b"b"
+
+
+def test_cli_create_sorted(tmp_path):
+    runner = CliRunner()
+
+    files = []
+    for name in ("a_2", "b_0", "c_1", "d_3"):
+        f = tmp_path / name
+        f.write_bytes(name.encode())
+        files.append(str(f))
+    shard = tmp_path / "shard"
+    result = runner.invoke(cli.shard_create, ["--sorted", str(shard), *files])
+    assert result.exit_code == 0, result.output
+    with Shard(str(shard)) as s:
+        offsets = {s.getindex(s.getpos(key)).object_offset: key for key in s}
+        # objects are stored in the order of their reversed file name
+        assert [s[offsets[offset]] for offset in sorted(offsets)] == [
+            b"b_0",
+            b"c_1",
+            b"a_2",
+            b"d_3",
+        ]
+
+
 def test_cli_delete_one_abort(small_shard):
     runner = CliRunner()
     key_num = 5
@@ -3,9 +3,11 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import array
 import gc
 from hashlib import sha256
 import logging
+import mmap
 import os
 from pathlib import Path
 import platform
@@ -15,7 +17,7 @@ import time
 
 import pytest
 
-from swh.shard import Shard, ShardCreator
+from swh.shard import KEY_LEN, Shard, ShardCreator
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +70,10 @@ def populated_shard_path(tmp_path):
     return str(shard_path)
 
 
+def test_key_len():
+    assert KEY_LEN == Shard.key_len == ShardCreator.key_len == 32
+
+
 def test_lookup(populated_shard_path):
     with Shard(populated_shard_path) as s:
         assert s.lookup(KEY_A) == OBJECT_A
@@ -75,6 +81,118 @@ def test_lookup(populated_shard_path):
         assert s.lookup(KEY_C) == OBJECT_C
 
 
+def test_write_buffers(tmp_path):
+    shard_path = str(tmp_path / "shard")
+    with ShardCreator(shard_path, 3) as s:
+        s.write(KEY_A, bytearray(OBJECT_A))
+        s.write(KEY_B, memoryview(b"xx" + OBJECT_B)[2:])
+        s.write(KEY_C, array.array("B", OBJECT_C))
+
+    with Shard(shard_path) as s:
+        assert s.lookup(KEY_A) == OBJECT_A
+        assert s.lookup(KEY_B) == OBJECT_B
+        assert s.lookup(KEY_C) == OBJECT_C
+
+
+def test_write_non_contiguous_buffer(tmp_path):
+    with ShardCreator(str(tmp_path / "shard"), 2) as s:
+        with pytest.raises(BufferError):
+            s.write(KEY_A, memoryview(OBJECT_C)[::2])
+        s.write(KEY_A, OBJECT_A)
+        s.write(KEY_B, OBJECT_B)
+
+
+def test_lookup_many(populated_shard_path):
+    with Shard(populated_shard_path) as s:
+        assert s.lookup_many([KEY_A, KEY_B, KEY_C]) == [OBJECT_A, OBJECT_B, OBJECT_C]
+        assert s.lookup_many(iter([KEY_C, KEY_A, KEY_C])) == [
+            OBJECT_C,
+            OBJECT_A,
+            OBJECT_C,
+        ]
+        assert s.lookup_many([]) == []
+        with pytest.raises(KeyError):
+            s.lookup_many([KEY_A, b"D" * Shard.key_len])
+        with pytest.raises(ValueError, match="Invalid key size"):
+            s.lookup_many([KEY_A, b"A"])
+        with pytest.raises(TypeError):
+            s.lookup_many([KEY_A, "A" * Shard.key_len])
+
+
+def test_locate(populated_shard_path):
+    content = open(populated_shard_path, "rb").read()
+    with Shard(populated_shard_path) as s:
+        for key, obj in ((KEY_A, OBJECT_A), (KEY_B, OBJECT_B), (KEY_C, OBJECT_C)):
+            position, size = s.locate(key)
+            assert size == len(obj)
+            assert content[position : position + size] == obj
+        with pytest.raises(KeyError):
+            s.locate(b"D" * Shard.key_len)
+        with pytest.raises(ValueError, match="Invalid key size"):
+            s.locate(b"A")
+
+
+def test_lookup_buffer(populated_shard_path):
+    with Shard(populated_shard_path) as s:
+        for key, obj in ((KEY_A, OBJECT_A), (KEY_B, OBJECT_B), (KEY_C, OBJECT_C)):
+            buf = s.lookup_buffer(key)
+            assert isinstance(buf, memoryview)
+            assert buf.readonly
+            assert buf == obj
+        with pytest.raises(KeyError):
+            s.lookup_buffer(b"D" * Shard.key_len)
+        with pytest.raises(ValueError, match="Invalid key size"):
+            s.lookup_buffer(b"A")
+    # the buffer remains usable after the shard has been closed
+    assert buf == OBJECT_C
+
+    Shard.delete(populated_shard_path, KEY_A)
+    Shard.delete(populated_shard_path, KEY_C)
+    with Shard(populated_shard_path) as s:
+        assert s.lookup_buffer(KEY_B) == OBJECT_B
+        for key in (KEY_A, KEY_C):
+            with pytest.raises(KeyError):
+                s.lookup_buffer(key)
+
+
+def test_concurrent_write_and_lookups(tmpdir):
+    from concurrent.futures import ThreadPoolExecutor
+
+    objects = {sha256(bytes([i]) * i).digest(): bytes([i]) * i for i in range(128)}
+    path = f"{tmpdir}/shard"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        with ShardCreator(path, len(objects)) as shard:
+            list(executor.map(shard.write, objects.keys(), objects.values()))
+        with Shard(path) as shard:
+            for _ in range(8):
+                assert list(executor.map(shard.lookup, objects)) == list(
+                    objects.values()
+                )
+
+
+def test_lookup_with_fingerprints(shard_with_deleted_objects_path):
+    with Shard(shard_with_deleted_objects_path) as shard:
+        assert not shard.fingerprints_loaded
+    with Shard(shard_with_deleted_objects_path, load_fingerprints=True) as shard:
+        assert shard.fingerprints_loaded
+        assert shard.lookup(KEY_B) == OBJECT_B
+        assert shard.lookup_buffer(KEY_B) == OBJECT_B
+        for key in (KEY_A, KEY_C, b"D" * Shard.key_len):
+            with pytest.raises(KeyError):
+                shard.lookup(key)
+            with pytest.raises(KeyError):
+                shard.lookup_buffer(key)
+
+
+def test_fingerprints_load_failure(populated_shard_path):
+    # make the index position point past the end of the file
+    with open(populated_shard_path, "r+b") as f:
+        f.seek(64)  # magic, padding, version, objects count, position & size
+        f.write((os.stat(populated_shard_path).st_size).to_bytes(8, "big"))
+    with pytest.raises(RuntimeError, match=r"fingerprints.*corrupted"):
+        Shard(populated_shard_path, load_fingerprints=True)
+
+
 def test_creator_open_without_permission(tmpdir):
     path = Path(tmpdir / "no-perm")
     path.touch()
@@ -166,12 +284,25 @@ def test_lookup_failure(corrupted_shard_path):
             shard.lookup(b"A" * Shard.key_len)
 
 
+def test_lookup_buffer_failure(corrupted_shard_path):
+    with Shard(corrupted_shard_path) as shard:
+        with pytest.raises(RuntimeError, match=r"failed.*corrupted"):
+            shard.lookup_buffer(b"A" * Shard.key_len)
+
+
 def test_lookup_errors_for_wrong_key_len(tmpdir):
     with pytest.raises(ValueError):
         with ShardCreator(f"{tmpdir}/shard", 1) as shard:
             shard.write(b"A", b"AAAA")
 
 
+def test_reader_errors_for_wrong_key_len(populated_shard_path):
+    with Shard(populated_shard_path) as shard:
+        for method in (shard.lookup, shard.getsize, shard.getpos, shard.find):
+            with pytest.raises(ValueError, match="Invalid key size"):
+                method(b"A")
+
+
 @pytest.fixture
 def shard_with_mismatched_key(tmp_path):
     path = tmp_path / "mismatched"
@@ -226,7 +357,7 @@ def payload(request):
 
 #
 # PYTHONMALLOC=malloc valgrind --tool=memcheck .tox/py3/bin/pytest \
-#    -k test_build_speed swh/perfecthash/tests/test_hash.py |& tee /tmp/v
+#    -k test_build_speed src/swh/shard/tests/test_shard.py |& tee /tmp/v
 #
 def test_build_speed(request, tmpdir, payload):
     start = time.time()
@@ -311,13 +442,19 @@ def shard_build(request, tmpdir, payload):
     with ShardCreator(shard_path, len(objects)) as shard:
         count = 0
         size = 0
-        with open(payload, "rb") as f:
+        # objects are written straight from the mmap-ed payload, without
+        # copying them in python bytes objects first
+        with (
+            open(payload, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+            memoryview(mm) as view,
+        ):
             for key in keys:
-                object = f.read(objects[key])
-                assert len(object) == objects[key]
-                count += 1
-                size += len(object)
-                shard.write(key, object)
+                with view[size : size + objects[key]] as object:
+                    assert len(object) == objects[key]
+                    count += 1
+                    size += len(object)
+                    shard.write(key, object)
         write_duration = time.time() - start
         start = time.time()
 